@@ -2,22 +2,32 @@ import os
 import asyncio
 import logging
 import sys
-from typing import Dict, Optional
-from datetime import datetime
+from typing import Any, Dict, List, Optional
+from dataclasses import dataclass, field
 from aiohttp import web
 
-from pyrogram import Client, filters
+# Use uvloop when installed. The loop must exist before pyrogram is imported:
+# pyrogram.sync captures the current loop at import and Client() reuses it
+try:
+    import uvloop
+except ImportError:
+    pass
+else:
+    asyncio.set_event_loop(uvloop.new_event_loop())
+
+from pyrogram import Client, filters, raw, utils as pyrogram_utils
 from pyrogram.types import (
     Message, InlineKeyboardMarkup, 
     InlineKeyboardButton, CallbackQuery
 )
 from pyrogram.enums import ParseMode
+from pyrogram.errors import FilePartMissing, FloodWait, MessageNotModified
 
 from config import config
 from utils.downloader import YouTubeDownloader
 from utils.helpers import (
     format_size, cleanup_temp_files, 
-    is_valid_youtube_url
+    is_valid_youtube_url, normalize_youtube_url, run_async
 )
 
 # Setup logging
@@ -27,36 +37,104 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Progress bars for every 5% step, built once
+PROGRESS_BARS = tuple("█" * i + "░" * (20 - i) for i in range(21))
+
+CHANNEL_URL = "https://youtube.com/@animarvelx"
+
+# Callback payloads: FORMAT_PREFIX + format_id selects a resolution, CANCEL_DATA cancels
+FORMAT_PREFIX = "f"
+CANCEL_DATA = "c"
+
+# Status keyboards carry no per-user data, so they are shared by every message
+CANCEL_BUTTON = InlineKeyboardButton("❌ Cancel", callback_data=CANCEL_DATA)
+CHANNEL_BUTTON = InlineKeyboardButton("📺 Visit Our Channel", url=CHANNEL_URL)
+CANCEL_KEYBOARD = InlineKeyboardMarkup([[CANCEL_BUTTON], [CHANNEL_BUTTON]])
+FINAL_KEYBOARD = InlineKeyboardMarkup([[CHANNEL_BUTTON]])
+
+def _bulk_unlink(paths: List[str]):
+    """Remove files in one pass, ignoring ones that are already gone"""
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Could not remove %s: %s", path, e)
+
+def _forget_download(user_id: int, task: asyncio.Task):
+    """Drop a finished download task, however it ended"""
+    if bot_state.active_downloads.get(user_id) is task:
+        del bot_state.active_downloads[user_id]
+
+def _quality_label(resolution: str) -> str:
+    """Extract just the resolution quality (e.g., "1920x1080" -> "1080p")"""
+    if 'x' in resolution:
+        return f"{resolution.rpartition('x')[2]}p"
+    return resolution
+
+def _format_button(format_info: Dict) -> InlineKeyboardButton:
+    """Build the menu button for one resolution option"""
+    text = f"{_quality_label(format_info.get('resolution', 'Unknown'))} {format_info.get('size', 'Unknown')}"
+    return InlineKeyboardButton(text, callback_data=FORMAT_PREFIX + format_info['format_id'])
+
 # Global state management
+@dataclass(slots=True)
+class UserSession:
+    """Per-user conversation and download state"""
+    chat_id: int
+    url: Optional[str] = None
+    status_message_id: Optional[int] = None
+    status_message: Optional[Message] = None
+    temp_files: List[str] = field(default_factory=list)
+    start_time: Optional[float] = None  # loop.time() when the session started
+    waiting_for_url: bool = False
+    thumbnail_url: Optional[str] = None
+    formats_by_id: Dict[str, Dict] = field(default_factory=dict)
+    progress: Optional[Dict[str, Any]] = None
+    last_caption: str = ''
+    edit_lock: asyncio.Semaphore = field(default_factory=lambda: asyncio.Semaphore(1))
+
 class BotState:
     def __init__(self):
         self.active_downloads: Dict[int, asyncio.Task] = {}
-        self.user_data: Dict[int, Dict] = {}
+        self.user_data: Dict[int, UserSession] = {}
         self.downloader = YouTubeDownloader()
         self.shutting_down = False
-        
-    async def cleanup_user(self, user_id: int):
-        """Clean up user data and cancel tasks"""
+        # One shared resolution lookup per URL while it is in flight
+        self.inflight: Dict[str, asyncio.Task] = {}
+        
+    async def get_resolutions(self, url: str) -> List[Dict]:
+        """Get available resolutions, sharing one lookup between concurrent callers"""
+        task = self.inflight.get(url)
+        if task is None:
+            task = asyncio.create_task(self.downloader.get_available_resolutions(url))
+            self.inflight[url] = task
+            task.add_done_callback(lambda _: self.inflight.pop(url, None))
+        
+        # Shield so one caller giving up does not cancel the lookup for the others
+        return await asyncio.shield(task)
+    
+    async def cleanup_user(self, user_id: int, unlink: bool = True):
+        """Clean up user data and cancel tasks
+        
+        The user's temp files are only deleted here when `unlink` is set,
+        so shutdown can batch the deletion itself.
+        """
         if user_id in self.active_downloads:
             task = self.active_downloads[user_id]
-            if not task.done():
+            # The download task cleans up after itself; it must not await itself
+            if not task.done() and task is not asyncio.current_task():
                 task.cancel()
                 try:
                     await task
                 except asyncio.CancelledError:
                     pass
-            del self.active_downloads[user_id]
-        
-        if user_id in self.user_data:
-            data = self.user_data[user_id]
-            if 'temp_files' in data:
-                for file_path in data['temp_files']:
-                    if os.path.exists(file_path):
-                        try:
-                            os.remove(file_path)
-                        except:
-                            pass
-            del self.user_data[user_id]
+            self.active_downloads.pop(user_id, None)
+        
+        data = self.user_data.pop(user_id, None)
+        if unlink and data and data.temp_files:
+            await run_async(_bulk_unlink, list(data.temp_files))
 
 bot_state = BotState()
 
@@ -72,28 +150,28 @@ app = Client(
 )
 
 # Health check server
+# aiohttp responses are single-use, so only the encoded bodies are shared
+_ALIVE_BODY = b"Bot is Alive and Running"
+_SHUTTING_DOWN_BODY = b"Bot is shutting down"
+
 async def health_check(request):
     """Health check endpoint for UptimeRobot"""
-    try:
-        if bot_state.shutting_down:
-            return web.Response(status=503, text="Bot is shutting down")
-        
-        return web.Response(text="Bot is Alive and Running")
-        
-    except Exception as e:
-        logger.error(f"Health check error: {e}")
-        return web.Response(status=500, text=f"Error: {str(e)}")
+    if bot_state.shutting_down:
+        return web.Response(status=503, body=_SHUTTING_DOWN_BODY, content_type="text/plain", charset="utf-8")
+    
+    return web.Response(body=_ALIVE_BODY, content_type="text/plain", charset="utf-8")
 
 async def start_web_server():
     """Starts the aiohttp web server."""
     server = web.Application()
     server.router.add_get("/", health_check)
     server.router.add_get("/health", health_check)
-    runner = web.AppRunner(server)
+    # Liveness pings are frequent and uninteresting; skip per-request access logging
+    runner = web.AppRunner(server, access_log=None)
     await runner.setup()
     site = web.TCPSite(runner, "0.0.0.0", config.HEALTH_PORT)
     await site.start()
-    logger.info(f"✅ Web server started on port {config.HEALTH_PORT}")
+    logger.info("✅ Web server started on port %s", config.HEALTH_PORT)
     return runner
 
 async def shutdown_handler():
@@ -104,10 +182,17 @@ async def shutdown_handler():
     logger.info("Shutdown requested...")
     bot_state.shutting_down = True
     
-    for user_id in list(bot_state.active_downloads.keys()):
-        await bot_state.cleanup_user(user_id)
+    # Collect every session's files first; cancelled tasks skip their own unlink
+    # while shutting down, so they are all removed in one pass below
+    temp_files = [path for session in bot_state.user_data.values() for path in session.temp_files]
+    await asyncio.gather(
+        *(bot_state.cleanup_user(user_id, unlink=False) for user_id in list(bot_state.active_downloads)),
+        return_exceptions=True
+    )
+    if temp_files:
+        await run_async(_bulk_unlink, temp_files)
     
-    cleanup_temp_files()
+    await cleanup_temp_files()
     logger.info("Shutdown complete")
 
 # ===== MESSAGE HANDLERS =====
@@ -138,17 +223,17 @@ async def start_command(client: Client, message: Message):
     """
     
     # Mark user as waiting for URL
-    bot_state.user_data[user_id] = {
-        'waiting_for_url': True,
-        'chat_id': message.chat.id
-    }
+    bot_state.user_data[user_id] = UserSession(
+        chat_id=message.chat.id,
+        waiting_for_url=True
+    )
     
     await message.reply_text(
         welcome_text,
         parse_mode=ParseMode.MARKDOWN,
         disable_web_page_preview=True
     )
-    logger.info(f"User {user_id} started bot")
+    logger.info("User %s started bot", user_id)
 
 @app.on_message(filters.command("download") & filters.private)
 async def download_command(client: Client, message: Message):
@@ -171,10 +256,10 @@ async def download_command(client: Client, message: Message):
     # Extract URL from command
     if len(message.command) < 2:
         # Mark user as waiting for URL
-        bot_state.user_data[user_id] = {
-            'waiting_for_url': True,
-            'chat_id': message.chat.id
-        }
+        bot_state.user_data[user_id] = UserSession(
+            chat_id=message.chat.id,
+            waiting_for_url=True
+        )
         await message.reply_text(
             "📎 **Please paste your YouTube video URL:**",
             parse_mode=ParseMode.MARKDOWN
@@ -192,7 +277,7 @@ async def handle_url_message(client: Client, message: Message):
     user_id = message.from_user.id
     
     # Check if user is waiting for URL
-    if user_id not in bot_state.user_data or not bot_state.user_data[user_id].get('waiting_for_url'):
+    if user_id not in bot_state.user_data or not bot_state.user_data[user_id].waiting_for_url:
         return
     
     url = message.text.strip()
@@ -210,6 +295,8 @@ async def handle_url_message(client: Client, message: Message):
 async def process_video_url(client: Client, message: Message, url: str):
     """Process YouTube video URL and show resolution options"""
     user_id = message.from_user.id
+    # Only the generic extractor copes with a missing scheme, and it is disabled
+    url = normalize_youtube_url(url)
     
     # Check if user already has an active download
     if user_id in bot_state.active_downloads:
@@ -220,24 +307,21 @@ async def process_video_url(client: Client, message: Message, url: str):
         return
     
     # Initialize user data
-    bot_state.user_data[user_id] = {
-        'url': url,
-        'chat_id': message.chat.id,
-        'status_message_id': None,
-        'status_message': None,
-        'temp_files': [],
-        'start_time': datetime.now(),
-        'waiting_for_url': False
-    }
+    bot_state.user_data[user_id] = UserSession(
+        chat_id=message.chat.id,
+        url=url,
+        start_time=asyncio.get_running_loop().time()
+    )
     
     try:
         # Get video info
         status_msg = await message.reply_text("📡 Fetching video information...")
-        bot_state.user_data[user_id]['status_message_id'] = status_msg.id
-        bot_state.user_data[user_id]['status_message'] = status_msg
+        bot_state.user_data[user_id].status_message_id = status_msg.id
+        bot_state.user_data[user_id].status_message = status_msg
         
         # Get available resolutions
-        formats = await bot_state.downloader.get_available_resolutions(url)
+        formats = await bot_state.get_resolutions(url)
+        bot_state.user_data[user_id].formats_by_id = {f['format_id']: f for f in formats}
         
         if not formats:
             await status_msg.edit_text("❌ No compatible formats found.")
@@ -245,32 +329,11 @@ async def process_video_url(client: Client, message: Message, url: str):
             return
         
         # Create resolution buttons (2 buttons per row for better layout)
-        keyboard = []
-        current_row = []
-        
-        for i, format_info in enumerate(formats, 1):
-            resolution = format_info.get('resolution', 'Unknown')
-            size = format_info.get('size', 'Unknown')
-            
-            # Extract just the resolution quality (e.g., "1920x1080" -> "1080p")
-            if 'x' in resolution:
-                height = resolution.split('x')[-1]
-                text = f"{height}p {size}"
-            else:
-                text = f"{resolution} {size}"
-            
-            callback_data = f"format_{user_id}_{format_info['format_id']}"
-            
-            current_row.append(InlineKeyboardButton(text, callback_data=callback_data))
-            
-            # Add 2 buttons per row
-            if len(current_row) >= 2 or i == len(formats):
-                keyboard.append(current_row)
-                current_row = []
+        buttons = [_format_button(format_info) for format_info in formats]
+        keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
         
         # Add cancel and channel link buttons
-        keyboard.append([InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_{user_id}")])
-        keyboard.append([InlineKeyboardButton("📺 Visit Our Channel", url="https://youtube.com/@animarvelx")])
+        keyboard.extend([[CANCEL_BUTTON], [CHANNEL_BUTTON]])
         
         # Send video info with buttons and thumbnail
         info_text = f"**📹 Title:** {formats[0]['title']}\n"
@@ -289,20 +352,20 @@ async def process_video_url(client: Client, message: Message, url: str):
                     reply_markup=InlineKeyboardMarkup(keyboard),
                     parse_mode=ParseMode.MARKDOWN
                 )
-                bot_state.user_data[user_id]['status_message_id'] = status_msg.id
-                bot_state.user_data[user_id]['status_message'] = status_msg
-                bot_state.user_data[user_id]['thumbnail_url'] = formats[0]['thumbnail']
+                bot_state.user_data[user_id].status_message_id = status_msg.id
+                bot_state.user_data[user_id].status_message = status_msg
+                bot_state.user_data[user_id].thumbnail_url = formats[0]['thumbnail']
             except Exception as thumb_error:
                 # If thumbnail fails, send text message instead
-                logger.warning(f"Failed to send thumbnail: {thumb_error}")
+                logger.warning("Failed to send thumbnail: %s", thumb_error)
                 status_msg = await message.reply_text(
                     info_text,
                     reply_markup=InlineKeyboardMarkup(keyboard),
                     parse_mode=ParseMode.MARKDOWN,
                     disable_web_page_preview=True
                 )
-                bot_state.user_data[user_id]['status_message_id'] = status_msg.id
-                bot_state.user_data[user_id]['status_message'] = status_msg
+                bot_state.user_data[user_id].status_message_id = status_msg.id
+                bot_state.user_data[user_id].status_message = status_msg
         else:
             await status_msg.edit_text(
                 info_text,
@@ -310,12 +373,12 @@ async def process_video_url(client: Client, message: Message, url: str):
                 parse_mode=ParseMode.MARKDOWN,
                 disable_web_page_preview=True
             )
-            bot_state.user_data[user_id]['status_message'] = status_msg
+            bot_state.user_data[user_id].status_message = status_msg
         
-        logger.info(f"Sent {len(formats)} resolution options to user {user_id}")
+        logger.info("Sent %s resolution options to user %s", len(formats), user_id)
         
     except Exception as e:
-        logger.error(f"Error fetching video info: {e}")
+        logger.error("Error fetching video info: %s", e)
         await message.reply_text(f"❌ Error: {str(e)}")
         await bot_state.cleanup_user(user_id)
 
@@ -331,57 +394,45 @@ async def handle_callback(client: Client, callback_query: CallbackQuery):
     
     data = callback_query.data
     
-    if data.startswith("format_"):
+    if data.startswith(FORMAT_PREFIX):
         try:
-            _, callback_user_id, format_id = data.split("_", 2)
-            callback_user_id = int(callback_user_id)
+            format_id = data[len(FORMAT_PREFIX):]
             
-            # Verify user owns this callback
-            if user_id != callback_user_id:
-                await callback_query.answer("This is not your download!", show_alert=True)
-                return
-            
-            await callback_query.answer("Starting download...")
-            
-            # Get user data
-            user_data = bot_state.user_data.get(callback_user_id)
+            # Menus are only sent to the user's private chat, so the
+            # sender's own session is the one this button belongs to
+            user_data = bot_state.user_data.get(user_id)
             if not user_data:
                 await callback_query.answer("Session expired", show_alert=True)
                 return
             
-            # Get format info for display
-            formats = await bot_state.downloader.get_available_resolutions(user_data['url'])
-            format_info = next((f for f in formats if f['format_id'] == format_id), None)
+            await callback_query.answer("Starting download...")
+            
+            # Get format info for display (cached when the menu was built)
+            format_info = user_data.formats_by_id.get(format_id)
             
             if not format_info:
                 try:
                     await callback_query.message.edit_caption("❌ Selected format no longer available.")
                 except:
                     await callback_query.message.edit_text("❌ Selected format no longer available.")
-                await bot_state.cleanup_user(callback_user_id)
+                await bot_state.cleanup_user(user_id)
                 return
             
             # Start download task
             task = asyncio.create_task(
-                download_and_send_video(client, callback_user_id, format_id, format_info, callback_query.message)
+                download_and_send_video(client, user_id, format_id, format_info, callback_query.message)
             )
             bot_state.active_downloads[user_id] = task
+            task.add_done_callback(lambda t: _forget_download(user_id, t))
             
         except Exception as e:
-            logger.error(f"Callback error: {e}")
+            logger.error("Callback error: %s", e)
             await callback_query.answer("Error starting download", show_alert=True)
     
-    elif data.startswith("cancel_"):
+    elif data == CANCEL_DATA:
         try:
-            _, callback_user_id = data.split("_")
-            callback_user_id = int(callback_user_id)
-            
-            if user_id != callback_user_id:
-                await callback_query.answer("This is not your download!", show_alert=True)
-                return
-            
             await callback_query.answer("Cancelling...")
-            await bot_state.cleanup_user(callback_user_id)
+            await bot_state.cleanup_user(user_id)
             
             try:
                 await callback_query.message.edit_caption("✅ Download cancelled.")
@@ -393,7 +444,51 @@ async def handle_callback(client: Client, callback_query: CallbackQuery):
                     await client.send_message(callback_query.message.chat.id, "✅ Download cancelled.")
             
         except Exception as e:
-            logger.error(f"Cancel error: {e}")
+            logger.error("Cancel error: %s", e)
+
+async def send_uploaded_video(
+    client: Client,
+    chat_id: int,
+    video_file,
+    path: str,
+    caption: str,
+    supports_streaming: bool,
+    reply_markup: InlineKeyboardMarkup
+):
+    """Send a video already uploaded with Client.save_file
+    
+    Mirrors Client.send_video, but takes the uploaded file so a retry
+    with different attributes does not upload the bytes again.
+    """
+    while True:
+        try:
+            await client.invoke(
+                raw.functions.messages.SendMedia(
+                    peer=await client.resolve_peer(chat_id),
+                    media=raw.types.InputMediaUploadedDocument(
+                        mime_type="video/mp4",
+                        file=video_file,
+                        attributes=[
+                            raw.types.DocumentAttributeVideo(
+                                supports_streaming=supports_streaming or None,
+                                duration=0,
+                                w=0,
+                                h=0
+                            ),
+                            raw.types.DocumentAttributeFilename(file_name=os.path.basename(path))
+                        ]
+                    ),
+                    random_id=client.rnd_id(),
+                    reply_markup=await reply_markup.write(client),
+                    **await pyrogram_utils.parse_text_entities(client, caption, ParseMode.MARKDOWN, None)
+                )
+            )
+            return
+        except FilePartMissing as e:
+            # Re-upload only the part Telegram lost
+            await client.save_file(path, file_id=video_file.id, file_part=e.value)
+        except FloodWait as e:
+            await asyncio.sleep(e.value)
 
 async def download_and_send_video(client: Client, user_id: int, format_id: str, format_info: Dict, status_msg):
     """Download and send video to user"""
@@ -401,135 +496,142 @@ async def download_and_send_video(client: Client, user_id: int, format_id: str,
     if not user_data:
         return
     
-    chat_id = user_data['chat_id']
-    url = user_data['url']
-    thumbnail_url = user_data.get('thumbnail_url')
+    chat_id = user_data.chat_id
+    url = user_data.url
+    thumbnail_url = user_data.thumbnail_url
+    
+    loop = asyncio.get_running_loop()
+    writer = None
     
-    # Create buttons with cancel and channel link
-    def create_buttons(show_cancel=True):
-        buttons = []
-        if show_cancel:
-            buttons.append([InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_{user_id}")])
-        buttons.append([InlineKeyboardButton("📺 Visit Our Channel", url="https://youtube.com/@animarvelx")])
-        return InlineKeyboardMarkup(buttons)
+    async def edit_status(text: str, **kwargs):
+        """Edit the status message; edits are serialized so they never race"""
+        async with user_data.edit_lock:
+            if thumbnail_url:
+                await status_msg.edit_caption(caption=text, **kwargs)
+            else:
+                await status_msg.edit_text(text, **kwargs)
     
     try:
-        last_progress_time = datetime.now()
-        last_progress_percent = 0
-        is_downloading = True
-        
         resolution = format_info.get('resolution', 'selected resolution')
         title = format_info.get('title', 'Video')
         
-        # Extract quality (e.g., "1920x1080" -> "1080p")
-        if 'x' in resolution:
-            height = resolution.split('x')[-1]
-            quality = f"{height}p"
-        else:
-            quality = resolution
+        quality = _quality_label(resolution)
         
-        def download_progress_callback(percent: float):
-            nonlocal last_progress_time, last_progress_percent, is_downloading
-            
-            if not is_downloading:
-                return
-            
-            # Only update every 3 seconds or if progress changed significantly
-            now = datetime.now()
-            time_diff = (now - last_progress_time).total_seconds()
-            
-            if time_diff >= 3 or abs(percent - last_progress_percent) >= 5:
-                progress_bar = "█" * int(percent / 5) + "░" * (20 - int(percent / 5))
-                caption_text = f"**{title}**\n\n⏬ **Downloading {quality}**\n{progress_bar} {percent:.1f}%"
+        header = f"**{title}**\n\n"
+        
+        # Latest progress, rendered by a single writer task
+        progress = {'pct': 0.0, 'phase': 'download', 'dirty': asyncio.Event()}
+        user_data.progress = progress
+        
+        async def progress_writer():
+            """Edit the status message with the latest progress, at most once per interval"""
+            dirty = progress['dirty']
+            last_edit = loop.time()
+            while True:
+                await dirty.wait()
                 
-                async def update_message():
-                    try:
-                        if thumbnail_url:
-                            await status_msg.edit_caption(
-                                caption=caption_text,
-                                parse_mode=ParseMode.MARKDOWN,
-                                reply_markup=create_buttons(show_cancel=True)
-                            )
-                        else:
-                            await status_msg.edit_text(
-                                caption_text,
-                                parse_mode=ParseMode.MARKDOWN,
-                                reply_markup=create_buttons(show_cancel=True)
-                            )
-                    except Exception as e:
-                        logger.debug(f"Progress update failed: {e}")
+                # Wait out the rest of the interval; ticks arriving meanwhile are merged
+                delay = 3 - (loop.time() - last_edit)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                dirty.clear()
+                last_edit = loop.time()
                 
-                # Schedule the coroutine in the event loop
-                asyncio.create_task(update_message())
-                last_progress_time = now
-                last_progress_percent = percent
+                percent = progress['pct']
+                progress_bar = PROGRESS_BARS[min(20, int(percent / 5))]
+                if progress['phase'] == 'download':
+                    caption_text = f"{header}⏬ **Downloading {quality}**\n{progress_bar} {percent:.1f}%"
+                elif progress['phase'] == 'upload':
+                    caption_text = f"{header}📤 **Uploading to Telegram**\n{progress_bar} {percent:.1f}%"
+                else:
+                    continue
+                
+                # Nothing changed since the last edit (e.g. a stalled download)
+                if caption_text == user_data.last_caption:
+                    continue
+                
+                # Only remember captions that are actually shown, so a failed
+                # edit is retried on the next identical render
+                try:
+                    await edit_status(
+                        caption_text,
+                        parse_mode=ParseMode.MARKDOWN,
+                        reply_markup=CANCEL_KEYBOARD
+                    )
+                    user_data.last_caption = caption_text
+                except MessageNotModified:
+                    user_data.last_caption = caption_text
+                except Exception as e:
+                    logger.debug("Progress update failed: %s", e)
+        
+        def download_progress_callback(percent: float):
+            # Already marshalled onto the event loop by the downloader
+            if progress['phase'] != 'download':
+                return
+            progress['pct'] = percent
+            progress['dirty'].set()
         
         # Initial download message
-        initial_caption = f"**{title}**\n\n⏬ **Starting download {quality}**\n░░░░░░░░░░░░░░░░░░░░ 0.0%"
+        initial_caption = f"{header}⏬ **Starting download {quality}**\n{PROGRESS_BARS[0]} 0.0%"
         try:
-            if thumbnail_url:
-                await status_msg.edit_caption(
-                    caption=initial_caption,
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=create_buttons(show_cancel=True)
-                )
-            else:
-                await status_msg.edit_text(
-                    initial_caption,
+            await edit_status(
+                initial_caption,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=CANCEL_KEYBOARD
+            )
+            user_data.last_caption = initial_caption
+        except Exception as e:
+            logger.warning("Failed to update initial message: %s", e)
+        
+        async def queued_callback():
+            queued_caption = f"{header}⏳ **Queued {quality}**\nWaiting for a free download slot..."
+            try:
+                await edit_status(
+                    queued_caption,
                     parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=create_buttons(show_cancel=True)
+                    reply_markup=CANCEL_KEYBOARD
                 )
-        except Exception as e:
-            logger.warning(f"Failed to update initial message: {e}")
+                user_data.last_caption = queued_caption
+            except Exception as e:
+                logger.debug("Queued status update failed: %s", e)
+        
+        writer = asyncio.create_task(progress_writer())
         
         # Download video
         download_path = await bot_state.downloader.download_video(
             url, 
             format_id, 
             user_id,
-            progress_callback=download_progress_callback
+            progress_callback=download_progress_callback,
+            queued_callback=queued_callback
         )
         
-        is_downloading = False
+        progress['phase'] = None
         
         if not download_path or not os.path.exists(download_path):
-            error_msg = f"**{title}**\n\n❌ Download failed."
+            error_msg = f"{header}❌ Download failed."
             try:
-                if thumbnail_url:
-                    await status_msg.edit_caption(
-                        caption=error_msg,
-                        parse_mode=ParseMode.MARKDOWN,
-                        reply_markup=create_buttons(show_cancel=False)
-                    )
-                else:
-                    await status_msg.edit_text(
-                        error_msg,
-                        parse_mode=ParseMode.MARKDOWN,
-                        reply_markup=create_buttons(show_cancel=False)
-                    )
+                await edit_status(
+                    error_msg,
+                    parse_mode=ParseMode.MARKDOWN,
+                    reply_markup=FINAL_KEYBOARD
+                )
             except:
                 pass
             return
         
-        user_data['temp_files'].append(download_path)
+        user_data.temp_files.append(download_path)
         
         # Check file size
         file_size = os.path.getsize(download_path)
         if file_size > config.MAX_FILE_SIZE:
-            error_msg = f"**{title}**\n\n❌ File size ({format_size(file_size)}) exceeds 850MB limit."
+            error_msg = f"{header}❌ File size ({format_size(file_size)}) exceeds 850MB limit."
             try:
-                if thumbnail_url:
-                    await status_msg.edit_caption(
-                        caption=error_msg,
-                        parse_mode=ParseMode.MARKDOWN,
-                        reply_markup=create_buttons(show_cancel=False)
-                    )
-                else:
-                    await status_msg.edit_text(
-                        error_msg,
-                        parse_mode=ParseMode.MARKDOWN,
-                        reply_markup=create_buttons(show_cancel=False)
-                    )
+                await edit_status(
+                    error_msg,
+                    parse_mode=ParseMode.MARKDOWN,
+                    reply_markup=FINAL_KEYBOARD
+                )
             except:
                 pass
             return
@@ -538,61 +640,27 @@ async def download_and_send_video(client: Client, user_id: int, format_id: str,
         duration = format_info.get('duration', '')
         channel = format_info.get('channel', '')
         
-        # Reset progress tracking for upload
-        last_progress_time = datetime.now()
-        last_progress_percent = 0
-        
         async def upload_progress_callback(current: int, total: int):
-            nonlocal last_progress_time, last_progress_percent
-            
             if total == 0:
                 return
             
-            percent = (current / total) * 100
-            
-            # Only update every 3 seconds or if progress changed significantly
-            now = datetime.now()
-            time_diff = (now - last_progress_time).total_seconds()
-            
-            if time_diff >= 3 or abs(percent - last_progress_percent) >= 5:
-                progress_bar = "█" * int(percent / 5) + "░" * (20 - int(percent / 5))
-                upload_caption = f"**{title}**\n\n📤 **Uploading to Telegram**\n{progress_bar} {percent:.1f}%"
-                
-                try:
-                    if thumbnail_url:
-                        await status_msg.edit_caption(
-                            caption=upload_caption,
-                            parse_mode=ParseMode.MARKDOWN,
-                            reply_markup=create_buttons(show_cancel=True)
-                        )
-                    else:
-                        await status_msg.edit_text(
-                            upload_caption,
-                            parse_mode=ParseMode.MARKDOWN,
-                            reply_markup=create_buttons(show_cancel=True)
-                        )
-                    last_progress_time = now
-                    last_progress_percent = percent
-                except Exception as e:
-                    logger.debug(f"Upload progress update failed: {e}")
+            progress['pct'] = (current / total) * 100
+            progress['dirty'].set()
         
         # Initial upload message
-        upload_caption = f"**{title}**\n\n📤 **Uploading to Telegram**\n░░░░░░░░░░░░░░░░░░░░ 0.0%"
+        upload_caption = f"{header}📤 **Uploading to Telegram**\n{PROGRESS_BARS[0]} 0.0%"
         try:
-            if thumbnail_url:
-                await status_msg.edit_caption(
-                    caption=upload_caption,
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=create_buttons(show_cancel=True)
-                )
-            else:
-                await status_msg.edit_text(
-                    upload_caption,
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=create_buttons(show_cancel=True)
-                )
+            await edit_status(
+                upload_caption,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=CANCEL_KEYBOARD
+            )
+            user_data.last_caption = upload_caption
         except Exception as e:
-            logger.debug(f"Upload status update failed: {e}")
+            logger.debug("Upload status update failed: %s", e)
+        
+        progress['pct'] = 0.0
+        progress['phase'] = 'upload'
         
         # Prepare final caption
         final_caption = f"**{title}**\n"
@@ -608,17 +676,27 @@ async def download_and_send_video(client: Client, user_id: int, format_id: str,
         if len(final_caption) > config.MAX_MESSAGE_LENGTH:
             final_caption = final_caption[:config.MAX_MESSAGE_LENGTH - 100] + "..."
         
-        # Send video with upload progress
+        # Upload once with progress; the non-streaming retry reuses the uploaded file
         try:
-            sent_video = await client.send_video(
-                chat_id=chat_id,
-                video=download_path,
-                caption=final_caption,
-                parse_mode=ParseMode.MARKDOWN,
-                supports_streaming=True,
-                progress=upload_progress_callback,
-                reply_markup=create_buttons(show_cancel=False)
-            )
+            video_file = await client.save_file(download_path, progress=upload_progress_callback)
+            
+            try:
+                await send_uploaded_video(
+                    client, chat_id, video_file, download_path,
+                    caption=final_caption,
+                    supports_streaming=True,
+                    reply_markup=FINAL_KEYBOARD
+                )
+            except Exception as upload_error:
+                logger.error("Upload error: %s", upload_error)
+                
+                # Try without streaming if streaming fails
+                await send_uploaded_video(
+                    client, chat_id, video_file, download_path,
+                    caption=final_caption,
+                    supports_streaming=False,
+                    reply_markup=FINAL_KEYBOARD
+                )
             
             # Delete the thumbnail message after successful upload
             try:
@@ -626,61 +704,41 @@ async def download_and_send_video(client: Client, user_id: int, format_id: str,
             except:
                 pass
             
-        except Exception as upload_error:
-            logger.error(f"Upload error: {upload_error}")
-            
-            # Try without streaming if streaming fails
+        except Exception as e:
+            # Delete thumbnail message even on error
             try:
-                sent_video = await client.send_video(
-                    chat_id=chat_id,
-                    video=download_path,
-                    caption=final_caption,
-                    parse_mode=ParseMode.MARKDOWN,
-                    supports_streaming=False,
-                    progress=upload_progress_callback,
-                    reply_markup=create_buttons(show_cancel=False)
-                )
+                await status_msg.delete()
+            except:
+                pass
                 
-                # Delete the thumbnail message after successful upload
-                try:
-                    await status_msg.delete()
-                except:
-                    pass
-                    
-            except Exception as e:
-                # Delete thumbnail message even on error
-                try:
-                    await status_msg.delete()
-                except:
-                    pass
-                    
-                await client.send_message(
-                    chat_id,
-                    f"❌ Upload failed: {str(e)}",
-                    reply_markup=create_buttons(show_cancel=False)
-                )
+            await client.send_message(
+                chat_id,
+                f"❌ Upload failed: {str(e)}",
+                reply_markup=FINAL_KEYBOARD
+            )
         
     except asyncio.CancelledError:
+        if writer:
+            writer.cancel()
         try:
-            if thumbnail_url:
-                await status_msg.edit_caption("❌ Download cancelled.")
-            else:
-                await status_msg.edit_text("❌ Download cancelled.")
+            await edit_status("❌ Download cancelled.")
         except:
             await client.send_message(chat_id, "❌ Download cancelled.")
     except Exception as e:
-        logger.error(f"Error in download process: {e}")
+        logger.error("Error in download process: %s", e)
+        if writer:
+            writer.cancel()
         try:
-            if thumbnail_url:
-                await status_msg.edit_caption(f"❌ Error: {str(e)}")
-            else:
-                await status_msg.edit_text(f"❌ Error: {str(e)}")
+            await edit_status(f"❌ Error: {str(e)}")
         except:
             await client.send_message(chat_id, f"❌ Error: {str(e)}")
     finally:
         # Cleanup
-        await bot_state.cleanup_user(user_id)
-        cleanup_temp_files(user_data.get('temp_files', []))
+        if writer:
+            writer.cancel()
+        # During shutdown the handler deletes everyone's files in one batch
+        await bot_state.cleanup_user(user_id, unlink=not bot_state.shutting_down)
+        await cleanup_temp_files(user_data.temp_files)
 
 @app.on_message(filters.command("cancel") & filters.private)
 async def cancel_command(client: Client, message: Message):
@@ -720,7 +778,7 @@ async def main():
     os.makedirs(config.TEMP_DIR, exist_ok=True)
     
     # Cleanup old temp files on startup
-    cleanup_temp_files()
+    await cleanup_temp_files()
     
     logger.info("Starting YouTube Downloader Bot...")
     
@@ -730,7 +788,7 @@ async def main():
         runner = await start_web_server()
         logger.info("✅ Web server started successfully")
     except Exception as e:
-        logger.error(f"❌ Failed to start web server: {e}")
+        logger.error("❌ Failed to start web server: %s", e)
         return
     
     # Start Bot
@@ -738,11 +796,11 @@ async def main():
         await app.start()
         
         me = await app.get_me()
-        logger.info(f"✅ Bot started successfully!")
-        logger.info(f"   Name: {me.first_name}")
-        logger.info(f"   Username: @{me.username}")
-        logger.info(f"   ID: {me.id}")
-        logger.info(f"   Health check: http://localhost:{config.HEALTH_PORT}/health")
+        logger.info("✅ Bot started successfully!")
+        logger.info("   Name: %s", me.first_name)
+        logger.info("   Username: @%s", me.username)
+        logger.info("   ID: %s", me.id)
+        logger.info("   Health check: http://localhost:%s/health", config.HEALTH_PORT)
         logger.info("Bot is now listening for messages. Send /start to your bot")
         
         # Keep bot running forever
@@ -751,7 +809,7 @@ async def main():
     except KeyboardInterrupt:
         logger.info("Keyboard interrupt received, shutting down...")
     except Exception as e:
-        logger.error(f"Fatal error: {e}")
+        logger.error("Fatal error: %s", e)
     finally:
         # Clean shutdown
         await shutdown_handler()
@@ -768,17 +826,16 @@ if __name__ == "__main__":
         print("❌ Missing credentials in .env file")
         sys.exit(1)
     
-    logger.info(f"Config loaded:")
-    logger.info(f"  API_ID: {config.API_ID}")
-    logger.info(f"  API_HASH: {config.API_HASH[:10]}...")
-    logger.info(f"  BOT_TOKEN: {config.BOT_TOKEN[:20]}...")
+    logger.info("Config loaded:")
+    logger.info("  API_ID: %s", config.API_ID)
+    logger.info("  API_HASH: %s...", config.API_HASH[:10])
+    logger.info("  BOT_TOKEN: %s...", config.BOT_TOKEN[:20])
     
-    # Get the event loop and run main
-    loop = asyncio.get_event_loop()
+    # Run main on the loop the client was created with (asyncio.run would start a new one)
     try:
-        loop.run_until_complete(main())
+        app.loop.run_until_complete(main())
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
-        logger.error(f"Fatal error: {e}")
+        logger.error("Fatal error: %s", e)
         sys.exit(1)
\ No newline at end of file
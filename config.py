@@ -1,60 +1,63 @@
 import os
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Mapping
 from dotenv import load_dotenv
-from pathlib import Path
 
 load_dotenv()
 
+# YT-DLP formats for H.264 + AAC
+_YDL_FORMATS = "bestvideo[ext=mp4][vcodec^=avc1]+bestaudio[ext=m4a]/bestvideo[ext=mp4][vcodec^=avc]+bestaudio[ext=m4a]/bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"
+
+# YT-DLP options for merging without re-encoding (read-only; copy before changing)
+_YDL_OPTS = MappingProxyType({
+    'format': _YDL_FORMATS,
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': False,
+    'socket_timeout': 30,
+    'noprogress': True,
+    'merge_output_format': 'mp4',
+    'postprocessor_args': {
+        'ffmpeg': [
+            '-c', 'copy',           # Copy without re-encoding
+            '-movflags', '+faststart',
+            '-max_muxing_queue_size', '9999',
+        ]
+    },
+    'postprocessors': [{
+        'key': 'FFmpegVideoConvertor',
+        'preferedformat': 'mp4',
+    }],
+    'outtmpl': 'temp/%(id)s.%(ext)s',
+    'progress_hooks': [],
+})
+
+@dataclass(frozen=True, slots=True)
 class Config:
     # Telegram API credentials
-    API_ID = int(os.getenv("API_ID", 0))
-    API_HASH = os.getenv("API_HASH", "")
-    BOT_TOKEN = os.getenv("BOT_TOKEN", "")
-    
+    API_ID: int = int(os.getenv("API_ID", 0))
+    API_HASH: str = os.getenv("API_HASH", "")
+    BOT_TOKEN: str = os.getenv("BOT_TOKEN", "")
+
     # Video configuration
-    MAX_FILE_SIZE = 850 * 1024 * 1024  # 850MB in bytes
-    
-    # YT-DLP formats for H.264 + AAC
-    YDL_FORMATS = "bestvideo[ext=mp4][vcodec^=avc1]+bestaudio[ext=m4a]/bestvideo[ext=mp4][vcodec^=avc]+bestaudio[ext=m4a]/bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"
-
-    # Cookies file (REQUIRED - must exist)
-    COOKIES_FILE = "/cookies.txt"
-    if Path(COOKIES_FILE).is_file():
-        print(f"✅ YouTube cookies file detected at: {COOKIES_FILE}")
-    else:
-        print(f"❌ Cookies file not found at: {COOKIES_FILE}")
-    
-    # YT-DLP options for merging without re-encoding
-    YDL_OPTS = {
-        'format': YDL_FORMATS,
-        'quiet': True,
-        'no_warnings': True,
-        'extract_flat': False,
-        'socket_timeout': 30,
-        'noprogress': True,
-        'merge_output_format': 'mp4',
-        'postprocessor_args': {
-            'ffmpeg': [
-                '-c', 'copy',           # Copy without re-encoding
-                '-movflags', '+faststart',
-                '-max_muxing_queue_size', '9999',
-            ]
-        },
-        'postprocessors': [{
-            'key': 'FFmpegVideoConvertor',
-            'preferedformat': 'mp4',
-        }],
-        'outtmpl': 'temp/%(id)s.%(ext)s',
-        'progress_hooks': [],
-    }
-    
+    MAX_FILE_SIZE: int = 850 * 1024 * 1024  # 850MB in bytes
+
+    YDL_FORMATS: str = _YDL_FORMATS
+
+    # Cookies file (REQUIRED - must exist, checked by the downloader)
+    COOKIES_FILE: str = "/cookies.txt"
+
+    YDL_OPTS: Mapping[str, Any] = field(default_factory=lambda: _YDL_OPTS)
+
     # Bot settings
-    TEMP_DIR = "temp"
-    MAX_CONCURRENT_DOWNLOADS = 1
-    MAX_MESSAGE_LENGTH = 4096
-    
+    TEMP_DIR: str = "temp"
+    # Bot-wide; each user is further limited to one download at a time
+    MAX_CONCURRENT_DOWNLOADS: int = 3
+    MAX_MESSAGE_LENGTH: int = 4096
+
     # Health check server
-    HEALTH_PORT = int(os.getenv("PORT", 8080))
-    
-    
-config = Config()
+    HEALTH_PORT: int = int(os.getenv("PORT", 8080))
 
+
+config = Config()
@@ -1,167 +1,290 @@
 import os
+import time
 import asyncio
 import logging
-import re
-from typing import Dict, List, Optional, Callable, Any
+import threading
+import importlib.util
+from typing import Dict, List, Optional, Callable, Any, Awaitable, Tuple
 from datetime import timedelta
-from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 
 import yt_dlp
 from config import config
+from utils.helpers import get_video_id, run_async
 
 logger = logging.getLogger(__name__)
 
+# Parsed resolution lists are reused for repeat lookups of the same video
+INFO_CACHE_TTL = 300  # seconds
+INFO_CACHE_SIZE = 128
+
+# Metadata lookups are light enough to run a few at a time
+INFO_CONCURRENCY = 4
+
+# Minimum seconds between progress callbacks; yt-dlp reports every chunk
+PROGRESS_DISPATCH_INTERVAL = 0.5
+
+# Only YouTube URLs get past is_valid_youtube_url, so skip matching every other extractor
+ALLOWED_EXTRACTORS = ['youtube', 'youtube:tab']
+
+# Codec/container prefixes accepted by _is_compatible_format
+_VIDEO_CODECS = ('avc', 'h264', 'h.264')
+_AUDIO_CODECS = ('aac', 'mp4a', 'opus', 'vorbis', 'mp3')
+_VIDEO_EXTS = frozenset({'mp4', 'webm', 'mkv'})
+
+# Keep yt-dlp's signature/player cache on tmpfs when the host has one
+# (None leaves yt-dlp on its default ~/.cache location)
+YDL_CACHE_DIR = '/dev/shm/yt-dlp' if os.path.isdir('/dev/shm') else None
+
+# Only format ids, resolutions and sizes are needed here. DASH/HLS
+# manifests are skipped (their qualities are dropped) and formats
+# are not probed; _is_compatible_format keeps H.264 anyway.
+# format_sort steers yt-dlp's worst-to-best ranking towards H.264/AAC/MP4
+INFO_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': False,
+    'socket_timeout': 30,
+    'cookiefile': config.COOKIES_FILE,
+    'cachedir': YDL_CACHE_DIR,
+    'allowed_extractors': ALLOWED_EXTRACTORS,
+    'youtube_include_dash_manifest': False,
+    'youtube_include_hls_manifest': False,
+    'check_formats': False,
+    'format_sort': ['res', 'fps', 'vcodec:h264', 'acodec:aac', 'ext:mp4'],
+    'extractor_args': {
+        'youtube': {
+            'player_skip': ['configs'],
+            'skip': ['hls', 'dash', 'translated_subs'],
+        }
+    },
+}
+
 class YouTubeDownloader:
     def __init__(self):
-        self.executor = ThreadPoolExecutor(max_workers=3)
+        # Separate limits so long downloads never queue metadata lookups
+        self._info_sem = asyncio.Semaphore(INFO_CONCURRENCY)
+        self._download_sem = asyncio.Semaphore(config.MAX_CONCURRENT_DOWNLOADS)
         self.active_downloads: Dict[int, Any] = {}
+        # video id -> (monotonic timestamp, resolution options), oldest first
+        self._info_cache: Dict[str, Tuple[float, List[Dict]]] = {}
+        # YoutubeDL instances are reused per worker thread (they are not thread-safe)
+        self._local = threading.local()
+        # ...but share one cookie jar, written back after each call like YoutubeDL.close()
+        self._cookiejar = None
+        self._cookie_lock = threading.Lock()
+        # Per-download output path, filled with str.format (yt-dlp fills %(ext)s)
+        self._outtmpl_fmt = os.path.join(config.TEMP_DIR, '{user_id}_{video_id}.%(ext)s')
         self._validate_cookies_file()
+        self._check_lazy_extractors()
     
     def _validate_cookies_file(self):
         """Validate that cookies.txt file exists"""
-        if not os.path.exists(config.COOKIES_FILE):
+        # One stat answers both checks
+        try:
+            cookies_size = os.stat(config.COOKIES_FILE).st_size
+        except FileNotFoundError:
             raise FileNotFoundError(
                 f"ERROR: '{config.COOKIES_FILE}' file not found!\n"
                 f"The cookies.txt file is REQUIRED for this bot to work.\n"
                 f"Please create a cookies.txt file in the root directory."
-            )
+            ) from None
         
         # Check if file is empty
-        if os.path.getsize(config.COOKIES_FILE) == 0:
+        if cookies_size == 0:
             raise ValueError(
                 f"ERROR: '{config.COOKIES_FILE}' file is empty!\n"
                 f"Please add valid YouTube cookies to the file."
             )
         
-        logger.info(f"✅ Cookies file found: {config.COOKIES_FILE}")
+        logger.info("✅ Cookies file found: %s", config.COOKIES_FILE)
+    
+    def _check_lazy_extractors(self):
+        """Warn when yt-dlp will import every extractor class up front"""
+        if os.environ.get('YTDLP_NO_LAZY_EXTRACTORS'):
+            logger.warning("YTDLP_NO_LAZY_EXTRACTORS is set; yt-dlp extractors will load eagerly")
+        elif importlib.util.find_spec('yt_dlp.extractor.lazy_extractors') is None:
+            logger.warning("yt-dlp was installed without lazy extractors; startup will be slower")
+    
+    def _get_info_ydl(self) -> yt_dlp.YoutubeDL:
+        """Get this thread's YoutubeDL for metadata lookups, creating it on first use"""
+        ydl = getattr(self._local, 'info_ydl', None)
+        if ydl is None:
+            ydl = self._local.info_ydl = yt_dlp.YoutubeDL(INFO_OPTS.copy())
+            self._share_cookies(ydl)
+        return ydl
+    
+    def _get_download_ydl(self) -> yt_dlp.YoutubeDL:
+        """Get this thread's YoutubeDL for downloads, creating it on first use"""
+        ydl = getattr(self._local, 'download_ydl', None)
+        if ydl is None:
+            opts = config.YDL_OPTS.copy()
+            opts['cookiefile'] = config.COOKIES_FILE
+            opts['cachedir'] = YDL_CACHE_DIR
+            opts['allowed_extractors'] = ALLOWED_EXTRACTORS
+            
+            # Ensure MP4 output with proper merging
+            opts['merge_output_format'] = 'mp4'
+            
+            ydl = self._local.download_ydl = yt_dlp.YoutubeDL(opts)
+            ydl.add_progress_hook(self._dispatch_progress)
+            self._share_cookies(ydl)
+        return ydl
+    
+    def _share_cookies(self, ydl: yt_dlp.YoutubeDL):
+        """Point a new YoutubeDL at the cookie jar shared by every cached instance"""
+        with self._cookie_lock:
+            if self._cookiejar is None:
+                self._cookiejar = ydl.cookiejar
+            else:
+                ydl.cookiejar = self._cookiejar
+    
+    def _save_cookies(self, ydl: yt_dlp.YoutubeDL):
+        """Write cookies YouTube rotated back to config.COOKIES_FILE"""
+        with self._cookie_lock:
+            try:
+                ydl.save_cookies()
+            except Exception as e:
+                logger.warning("Could not save cookies: %s", e)
+    
+    def _dispatch_progress(self, d: Dict):
+        """Forward yt-dlp progress to the download running on this thread"""
+        hook = getattr(self._local, 'progress_hook', None)
+        if hook:
+            hook(d)
         
     async def get_available_resolutions(self, url: str) -> List[Dict]:
         """Get available video resolutions with size information"""
+        cache_key = get_video_id(url) or url
+        cached = self._info_cache.pop(cache_key, None)
+        if cached and time.monotonic() - cached[0] < INFO_CACHE_TTL:
+            # Re-insert to mark as most recently used
+            self._info_cache[cache_key] = cached
+            return cached[1]
+        
         try:
-            loop = asyncio.get_event_loop()
-            
             def extract_info():
-                opts = {
-                    'quiet': True,
-                    'no_warnings': True,
-                    'extract_flat': False,
-                    'socket_timeout': 30,
-                    'cookiefile': config.COOKIES_FILE,
+                ydl = self._get_info_ydl()
+                try:
+                    info = ydl.extract_info(url, download=False)
+                finally:
+                    self._save_cookies(ydl)
+                
+                if not info:
+                    return []
+                
+                # Get basic video info
+                video_info = {
+                    'title': info.get('title', 'Unknown'),
+                    'duration': str(timedelta(seconds=info.get('duration', 0))),
+                    'channel': info.get('channel', 'Unknown'),
+                    'thumbnail': info.get('thumbnail'),
+                    'formats': []
                 }
                 
-                with yt_dlp.YoutubeDL(opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
+                # Find all video formats with H.264 codec
+                video_formats = []
+                audio_formats = []
+                
+                # Walk yt-dlp's ranking best first so the first format seen at each
+                # resolution wins (within a resolution, damaged formats rank last)
+                for f in reversed(info.get('formats') or []):
+                    # Anything over the limit on its own is dropped below anyway
+                    filesize = f.get('filesize') or f.get('filesize_approx') or 0
+                    if filesize > config.MAX_FILE_SIZE:
+                        continue
+                    
+                    # Check if format is compatible
+                    if not self._is_compatible_format(f):
+                        continue
                     
-                    if not info:
-                        return []
+                    format_id = f.get('format_id', '')
+                    vcodec = f.get('vcodec', '')
+                    acodec = f.get('acodec', '')
+                    resolution = f.get('resolution', 'audio only')
+                    fps = f.get('fps', 0)
                     
-                    # Get basic video info
-                    video_info = {
-                        'title': info.get('title', 'Unknown'),
-                        'duration': str(timedelta(seconds=info.get('duration', 0))),
-                        'channel': info.get('channel', 'Unknown'),
-                        'thumbnail': info.get('thumbnail'),
-                        'formats': []
+                    format_data = {
+                        'format_id': format_id,
+                        'resolution': resolution,
+                        'fps': str(int(fps)) if fps else '',
+                        'vcodec': vcodec,
+                        'acodec': acodec,
+                        'filesize': filesize,
+                        'ext': f.get('ext', ''),
+                        'has_video': vcodec != 'none',
+                        'has_audio': acodec != 'none',
+                        'height': f.get('height') or 0,
                     }
                     
-                    # Find all video formats with H.264 codec
-                    video_formats = []
-                    audio_formats = []
+                    if vcodec != 'none':
+                        video_formats.append(format_data)
+                    elif acodec != 'none':
+                        audio_formats.append(format_data)
+                
+                # Get best audio format
+                best_audio = None
+                if audio_formats:
+                    # Prefer AAC audio
+                    aac_audio = [a for a in audio_formats if 'aac' in a['acodec'].lower() or 'mp4a' in a['acodec'].lower()]
+                    best_audio = max(aac_audio or audio_formats, key=itemgetter('filesize'))
+                
+                # Keep the first (best) format of each resolution
+                by_res: Dict[str, Dict] = {}
+                for video_format in video_formats:
+                    by_res.setdefault(video_format['resolution'], video_format)
+                
+                # Create resolution options
+                resolution_options = []
+                
+                # yt-dlp ranks on more than resolution (e.g. penalized formats sort
+                # after 144p), so order the few distinct resolutions by height
+                for video_format in sorted(by_res.values(), key=itemgetter('height'), reverse=True):
+                    resolution = video_format['resolution']
                     
-                    for f in info.get('formats', []):
-                        # Check if format is compatible
-                        if not self._is_compatible_format(f):
-                            continue
-                        
-                        format_id = f.get('format_id', '')
-                        vcodec = f.get('vcodec', '')
-                        acodec = f.get('acodec', '')
-                        resolution = f.get('resolution', 'audio only')
-                        fps = f.get('fps', 0)
-                        filesize = f.get('filesize') or f.get('filesize_approx', 0)
-                        
-                        format_data = {
-                            'format_id': format_id,
-                            'resolution': resolution,
-                            'fps': str(int(fps)) if fps else '',
-                            'vcodec': vcodec,
-                            'acodec': acodec,
-                            'filesize': filesize,
-                            'ext': f.get('ext', ''),
-                            'has_video': vcodec != 'none',
-                            'has_audio': acodec != 'none',
-                        }
-                        
-                        if vcodec != 'none':
-                            video_formats.append(format_data)
-                        elif acodec != 'none':
-                            audio_formats.append(format_data)
+                    # Skip if resolution is invalid
+                    if not resolution or resolution == 'audio only':
+                        continue
                     
-                    # Sort video formats by resolution (highest first)
-                    video_formats.sort(key=lambda x: self._parse_resolution(x['resolution']), reverse=True)
+                    # Calculate total size (video + best audio)
+                    total_size = video_format['filesize'] or 0
+                    format_id = video_format['format_id']
                     
-                    # Get best audio format
-                    best_audio = None
-                    if audio_formats:
-                        # Prefer AAC audio
-                        aac_audio = [a for a in audio_formats if 'aac' in a['acodec'].lower() or 'mp4a' in a['acodec'].lower()]
-                        if aac_audio:
-                            best_audio = max(aac_audio, key=lambda x: x.get('filesize', 0))
-                        else:
-                            best_audio = max(audio_formats, key=lambda x: x.get('filesize', 0))
+                    # If video doesn't have audio, add best audio format
+                    if not video_format['has_audio'] and best_audio:
+                        total_size += (best_audio['filesize'] or 0)
+                        format_id = f"{video_format['format_id']}+{best_audio['format_id']}"
                     
-                    # Create resolution options
-                    resolution_options = []
-                    seen_resolutions = set()
+                    # Skip if too large
+                    if total_size > config.MAX_FILE_SIZE:
+                        continue
                     
-                    for video_format in video_formats:
-                        resolution = video_format['resolution']
-                        
-                        # Skip duplicate resolutions
-                        if resolution in seen_resolutions:
-                            continue
-                        
-                        # Skip if resolution is invalid
-                        if not resolution or resolution == 'audio only':
-                            continue
-                        
-                        seen_resolutions.add(resolution)
-                        
-                        # Calculate total size (video + best audio)
-                        total_size = video_format['filesize'] or 0
-                        format_id = video_format['format_id']
-                        
-                        # If video doesn't have audio, add best audio format
-                        if not video_format['has_audio'] and best_audio:
-                            total_size += (best_audio['filesize'] or 0)
-                            format_id = f"{video_format['format_id']}+{best_audio['format_id']}"
-                        
-                        # Skip if too large
-                        if total_size > config.MAX_FILE_SIZE:
-                            continue
-                        
-                        # Format resolution string
-                        if video_format['fps'] and int(video_format['fps']) > 30:
-                            resolution_str = f"{resolution} {video_format['fps']}fps"
-                        else:
-                            resolution_str = resolution
-                        
-                        resolution_options.append({
-                            'format_id': format_id,
-                            'resolution': resolution_str,
-                            'size': self._format_size(total_size),
-                            'filesize': total_size,
-                            'fps': video_format['fps'],
-                            'title': video_info['title'],
-                            'duration': video_info['duration'],
-                            'channel': video_info['channel'],
-                            'thumbnail': video_info['thumbnail'],
-                        })
+                    # Format resolution string
+                    if video_format['fps'] and int(video_format['fps']) > 30:
+                        resolution_str = f"{resolution} {video_format['fps']}fps"
+                    else:
+                        resolution_str = resolution
+                    
+                    resolution_options.append({
+                        'format_id': format_id,
+                        'resolution': resolution_str,
+                        'size': self._format_size(total_size),
+                        'filesize': total_size,
+                        'fps': video_format['fps'],
+                        'title': video_info['title'],
+                        'duration': video_info['duration'],
+                        'channel': video_info['channel'],
+                        'thumbnail': video_info['thumbnail'],
+                    })
                     
                     # Limit to reasonable number of options (max 8)
-                    return resolution_options[:8]
+                    if len(resolution_options) == 8:
+                        break
+                
+                return resolution_options
             
-            resolutions = await loop.run_in_executor(self.executor, extract_info)
+            async with self._info_sem:
+                resolutions = await asyncio.to_thread(extract_info)
             
             if not resolutions:
                 # Fallback to best available format
@@ -177,10 +300,14 @@ class YouTubeDownloader:
                     'thumbnail': None,
                 }]
             
+            self._info_cache[cache_key] = (time.monotonic(), resolutions)
+            if len(self._info_cache) > INFO_CACHE_SIZE:
+                del self._info_cache[next(iter(self._info_cache))]
+            
             return resolutions
             
         except Exception as e:
-            logger.error(f"Error getting resolutions: {e}")
+            logger.error("Error getting resolutions: %s", e)
             return []
     
     async def download_video(
@@ -188,9 +315,14 @@ class YouTubeDownloader:
         url: str, 
         format_id: str, 
         user_id: int,
-        progress_callback: Optional[Callable[[float], None]] = None
+        progress_callback: Optional[Callable[[float], None]] = None,
+        queued_callback: Optional[Callable[[], Awaitable[None]]] = None
     ) -> Optional[str]:
-        """Download video with FFmpeg post-processing for merging"""
+        """Download video with FFmpeg post-processing for merging
+        
+        `queued_callback` is awaited when every download slot is busy,
+        before waiting for one to free up.
+        """
         try:
             loop = asyncio.get_event_loop()
             
@@ -203,8 +335,14 @@ class YouTubeDownloader:
                 'filename': None
             }
             self.active_downloads[user_id] = download_info
+            # Monotonic time and percent of the last callback sent to the loop
+            last_sent = [0.0, 0.0]
             
             def progress_hook(d):
+                # Stop yt-dlp on the worker thread once the job is cancelled
+                if download_info['status'] == 'cancelled':
+                    raise yt_dlp.utils.DownloadCancelled()
+                
                 if d['status'] == 'downloading':
                     total = d.get('total_bytes') or d.get('total_bytes_estimate')
                     downloaded = d.get('downloaded_bytes', 0)
@@ -215,63 +353,90 @@ class YouTubeDownloader:
                         download_info['speed'] = d.get('speed', 0)
                         download_info['eta'] = d.get('eta', 0)
                         
-                        if progress_callback:
+                        now = time.monotonic()
+                        if progress_callback and now - last_sent[0] >= PROGRESS_DISPATCH_INTERVAL:
+                            last_sent[0], last_sent[1] = now, percent
                             loop.call_soon_threadsafe(progress_callback, percent)
                 
                 elif d['status'] == 'finished':
                     download_info['status'] = 'processing'
                     download_info['percent'] = 100
-                    if progress_callback:
+                    # Skip the repeat when the last update already showed ~100%
+                    if progress_callback and last_sent[1] < 99:
+                        last_sent[1] = 100
                         loop.call_soon_threadsafe(progress_callback, 100)
                 
                 elif d['status'] == 'postprocessing':
                     download_info['status'] = 'postprocessing'
             
             def download():
-                opts = config.YDL_OPTS.copy()
-                opts['progress_hooks'] = [progress_hook]
-                opts['format'] = format_id
-                opts['cookiefile'] = config.COOKIES_FILE
-                
-                # Generate safe filename
-                safe_title = re.sub(r'[^\w\s-]', '', url.split('=')[-1] if '=' in url else url[-11:])
-                opts['outtmpl'] = os.path.join(config.TEMP_DIR, f'{user_id}_{safe_title}.%(ext)s')
+                ydl = self._get_download_ydl()
+                self._local.progress_hook = progress_hook
+                ydl.format_selector = ydl.build_format_selector(format_id)
                 
-                # Ensure MP4 output with proper merging
-                opts['merge_output_format'] = 'mp4'
+                # The video id is already filename-safe
+                safe_title = get_video_id(url) or 'video'
+                ydl.params['outtmpl']['default'] = self._outtmpl_fmt.format(user_id=user_id, video_id=safe_title)
                 
-                with yt_dlp.YoutubeDL(opts) as ydl:
+                try:
                     info = ydl.extract_info(url, download=True)
-                    filename = ydl.prepare_filename(info)
-                    
-                    # Ensure .mp4 extension
-                    if not filename.endswith('.mp4'):
-                        base, _ = os.path.splitext(filename)
-                        mp4_file = base + '.mp4'
-                        if os.path.exists(mp4_file):
-                            filename = mp4_file
-                    
-                    download_info['filename'] = filename
-                    return filename
+                finally:
+                    self._local.progress_hook = None
+                    self._save_cookies(ydl)
+                filename = ydl.prepare_filename(info)
+                
+                # Ensure .mp4 extension
+                if not filename.endswith('.mp4'):
+                    base, _ = os.path.splitext(filename)
+                    mp4_file = base + '.mp4'
+                    if os.path.exists(mp4_file):
+                        filename = mp4_file
+                
+                download_info['filename'] = filename
+                return filename
+            
+            if self._download_sem.locked() and queued_callback:
+                await queued_callback()
             
-            filename = await loop.run_in_executor(self.executor, download)
+            async with self._download_sem:
+                worker = asyncio.ensure_future(asyncio.to_thread(download))
+                try:
+                    filename = await asyncio.shield(worker)
+                except asyncio.CancelledError:
+                    # Keep the slot until the thread has actually stopped; the
+                    # progress hook aborts it, only a merge in progress runs on
+                    download_info['status'] = 'cancelled'
+                    try:
+                        orphan = await worker
+                    except Exception:
+                        orphan = None
+                    if orphan:
+                        try:
+                            await run_async(os.remove, orphan)
+                        except FileNotFoundError:
+                            pass
+                    self.active_downloads.pop(user_id, None)
+                    raise
             
             # Remove from active downloads
             if user_id in self.active_downloads:
                 del self.active_downloads[user_id]
             
-            # Check file size
-            if filename and os.path.exists(filename):
-                file_size = os.path.getsize(filename)
+            # Check file size (filesystem calls stay off the event loop)
+            if filename:
+                try:
+                    file_size = (await run_async(os.stat, filename)).st_size
+                except FileNotFoundError:
+                    file_size = 0
                 if file_size > config.MAX_FILE_SIZE:
-                    logger.warning(f"File too large: {file_size} bytes")
-                    os.remove(filename)
+                    logger.warning("File too large: %s bytes", file_size)
+                    await run_async(os.remove, filename)
                     return None
             
             return filename
             
         except Exception as e:
-            logger.error(f"Download error: {e}")
+            logger.error("Download error: %s", e)
             if user_id in self.active_downloads:
                 del self.active_downloads[user_id]
             return None
@@ -288,17 +453,17 @@ class YouTubeDownloader:
         
         # For video formats, require H.264
         if vcodec != 'none':
-            if not any(codec in vcodec for codec in ['avc', 'h264', 'h.264']):
+            if not vcodec.startswith(_VIDEO_CODECS):
                 return False
             
             # Prefer MP4 container for video
-            if ext not in ['mp4', 'webm', 'mkv']:
+            if ext not in _VIDEO_EXTS:
                 return False
         
         # For audio formats, prefer AAC/MP4A
         if acodec != 'none':
             # Accept any audio codec, but prefer AAC
-            if not any(codec in acodec for codec in ['aac', 'mp4a', 'opus', 'vorbis', 'mp3']):
+            if not acodec.startswith(_AUDIO_CODECS):
                 return False
         
         return True
@@ -314,26 +479,6 @@ class YouTubeDownloader:
             size_bytes /= 1024.0
         return f"{size_bytes:.1f} TB"
     
-    def _parse_resolution(self, resolution_str: str) -> int:
-        """Extract numeric resolution from string"""
-        try:
-            if not resolution_str or resolution_str == 'audio only':
-                return 0
-            
-            # Extract resolution (e.g., "1920x1080" -> 1080, "1080p" -> 1080)
-            match = re.search(r'(\d+)[xp]', resolution_str)
-            if match:
-                return int(match.group(1))
-            
-            # Try to find just numbers
-            match = re.search(r'(\d+)', resolution_str)
-            if match:
-                return int(match.group(1))
-            
-            return 0
-        except:
-            return 0
-    
     def cancel_download(self, user_id: int):
         """Cancel an active download"""
         if user_id in self.active_downloads:
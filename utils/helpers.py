@@ -1,14 +1,27 @@
 import os
-import glob
+import re
+import time
 import logging
 import hashlib
 import asyncio
-from datetime import datetime, timedelta
 from typing import List, Optional
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
 
+# Common watch/short-link/shorts URLs, checked before the full parse
+_YT_RE = re.compile(
+    r'^(?:https?://)?(?:www\.|m\.)?'
+    r'(?:youtube\.com/watch\?v=|youtu\.be/|youtube\.com/shorts/)[A-Za-z0-9_-]{11}'
+)
+
+# YouTube hosts (after stripping "www.") and their subdomains
+_YT_EXACT = frozenset({'youtube.com', 'youtu.be', 'm.youtube.com', 'youtube-nocookie.com'})
+_YT_SUFFIXES = ('.youtube.com', '.youtu.be', '.youtube-nocookie.com')
+
+# The 11-character video id in watch, short-link, embed and shorts URLs
+_YT_ID_RX = re.compile(r'(?:[?&]v=|youtu\.be/|/embed/|/shorts/)([A-Za-z0-9_-]{11})')
+
 def format_size(size_bytes: int) -> str:
     """Format size in human readable format"""
     if not size_bytes or size_bytes <= 0:
@@ -20,46 +33,49 @@ def format_size(size_bytes: int) -> str:
         size_bytes /= 1024.0
     return f"{size_bytes:.2f} TB"
 
-def cleanup_temp_files(files_to_keep: List[str] = None):
+async def cleanup_temp_files(files_to_keep: List[str] = None):
+    """Clean up old temporary files without blocking the event loop"""
+    await run_async(_cleanup_temp_files, files_to_keep)
+
+def _cleanup_temp_files(files_to_keep: List[str] = None):
     """Clean up old temporary files"""
     temp_dir = "temp"
-    if not os.path.exists(temp_dir):
-        return
+    keep = set(files_to_keep or ())
+    
+    # Files older than 10 minutes are removed
+    cutoff = time.time() - 600
     
     try:
-        # Get all files in temp directory
-        all_files = glob.glob(os.path.join(temp_dir, "*"))
-        
-        for file_path in all_files:
-            # Skip files we want to keep
-            if files_to_keep and file_path in files_to_keep:
-                continue
-            
-            if os.path.exists(file_path):
+        # Walk the temp directory; DirEntry caches stat results
+        with os.scandir(temp_dir) as entries:
+            for entry in entries:
+                # Leave hidden files (e.g. .gitkeep) alone
+                if entry.name.startswith('.'):
+                    continue
+                
+                # Skip files we want to keep
+                if entry.path in keep:
+                    continue
+                
                 try:
-                    # Check if file is older than 10 minutes
-                    file_age = datetime.now() - datetime.fromtimestamp(
-                        os.path.getmtime(file_path)
-                    )
-                    
-                    if file_age > timedelta(minutes=10):
-                        os.remove(file_path)
-                        logger.debug(f"Cleaned up: {file_path}")
+                    if entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                        logger.debug("Cleaned up: %s", entry.path)
+                except FileNotFoundError:
+                    # Already removed by a finished download
+                    pass
                 except Exception as e:
-                    logger.warning(f"Could not remove {file_path}: {e}")
+                    logger.warning("Could not remove %s: %s", entry.path, e)
     
+    except FileNotFoundError:
+        return
     except Exception as e:
-        logger.error(f"Error during cleanup: {e}")
+        logger.error("Error during cleanup: %s", e)
 
 def is_valid_youtube_url(url: str) -> bool:
     """Validate YouTube URL"""
-    youtube_domains = [
-        'youtube.com',
-        'youtu.be',
-        'm.youtube.com',
-        'www.youtube.com',
-        'youtube-nocookie.com'
-    ]
+    if _YT_RE.match(url):
+        return True
     
     try:
         parsed = urlparse(url)
@@ -70,46 +86,25 @@ def is_valid_youtube_url(url: str) -> bool:
             domain = domain[4:]
         
         # Check if domain is YouTube
-        if domain not in youtube_domains and not any(domain.endswith(d) for d in youtube_domains):
+        if domain not in _YT_EXACT and not domain.endswith(_YT_SUFFIXES):
             return False
         
-        # Check if it's a valid YouTube video URL
-        if domain == 'youtu.be':
-            return len(parsed.path) > 1  # Should have video ID after /
-        
-        # Check for watch parameter
-        query = parse_qs(parsed.query)
-        if 'v' in query:
-            return len(query['v'][0]) > 0
-        
-        # Check for embed URL
-        if '/embed/' in parsed.path:
-            return True
-        
-        return False
+        # Check it points at a video (watch, short link, embed or shorts)
+        return _YT_ID_RX.search(url) is not None
         
     except Exception:
         return False
 
 def get_video_id(url: str) -> Optional[str]:
     """Extract video ID from YouTube URL"""
-    try:
-        parsed = urlparse(url)
-        
-        if parsed.netloc == 'youtu.be':
-            return parsed.path[1:]  # Remove leading slash
-        
-        query = parse_qs(parsed.query)
-        if 'v' in query:
-            return query['v'][0]
-        
-        # Check for embed URL
-        if '/embed/' in parsed.path:
-            return parsed.path.split('/embed/')[1].split('/')[0]
-        
-        return None
-    except Exception:
-        return None
+    match = _YT_ID_RX.search(url)
+    return match.group(1) if match else None
+
+def normalize_youtube_url(url: str) -> str:
+    """Add https:// to scheme-less URLs; yt-dlp's YouTube extractors require a scheme"""
+    if '://' not in url:
+        return 'https://' + url
+    return url
 
 async def run_async(func, *args, **kwargs):
     """Run a synchronous function asynchronously"""
@@ -132,4 +127,4 @@ def safe_filename(filename: str, max_length: int = 200) -> str:
 
 def generate_file_hash(content: str) -> str:
     """Generate a hash for file identification"""
-    return hashlib.md5(content.encode()).hexdigest()[:8]
\ No newline at end of file
+    return hashlib.blake2b(content.encode(), digest_size=4).hexdigest()
\ No newline at end of file